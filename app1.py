@@ -1,23 +1,55 @@
 # app1.py
 
 import os
+import time
+import uuid
+import hashlib
+import zipfile
 import streamlit as st
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from io import BytesIO
-from simulation import run_simulation
+from simulation import run_simulation, EXCEL_ENGINE
 
 # 1. Page config
 st.set_page_config(page_title="Grain Distribution Simulator", layout="wide")
 st.title("🚛 Grain Distribution Simulator")
 
 # 2. Helper: write multiple DataFrames into a single Excel in memory
+#    (in_memory stops xlsxwriter from spooling each worksheet through temp files
+#    before zipping them into the buffer)
 def to_excel(sheets: dict[str, pd.DataFrame]) -> bytes:
     buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
+    with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"in_memory": True}}) as writer:
         for name, df in sheets.items():
             df.to_excel(writer, sheet_name=name, index=False)
     return buf.getvalue()
 
+#    Parquet needs one type per column, but reference columns such as
+#    Linked_LG_ID / Mapped_LG_IDs hold IDs typed as numbers next to text
+#    ("1" vs "1,2,3"). Those are stored as strings (missing cells stay
+#    missing); run_simulation reads the references as text anyway.
+def parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    obj_cols = df.select_dtypes(include="object").columns
+    return df.assign(**{c: df[c].where(df[c].isna(), df[c].astype(str)) for c in obj_cols})
+
+#    Faster alternative for large results: one zstd Parquet file per sheet in a
+#    ZIP. Entries are stored uncompressed since Parquet is already compressed,
+#    and each table is written straight into its entry (no per-sheet bytes copy).
+def to_parquet_bundle(sheets: dict[str, pd.DataFrame]) -> bytes:
+    buf = BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for name, df in sheets.items():
+            try:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+            except (TypeError, ValueError):
+                table = pa.Table.from_pandas(parquet_safe(df), preserve_index=False)
+            with zf.open(f"{name}.parquet", "w") as entry:
+                pq.write_table(table, entry, compression="zstd")
+    return buf.getvalue()
+
 # 3. File uploader (or fallback to a local template)
 uploaded = st.file_uploader("Upload master workbook (.xlsx)", type="xlsx")
 if uploaded is not None:
@@ -29,18 +61,136 @@ else:
     st.stop()
 
 # 4. Load input sheets from the workbook
-@st.cache_data
+#    Parsed sheets are also persisted as Parquet under CACHE_DIR, keyed by the
+#    workbook's content hash, so a workbook seen before skips Excel parsing
+#    even in a fresh session.
+#    Operations note: the cache holds the parsed contents of every workbook
+#    uploaded to this server. Files older than CACHE_MAX_AGE_DAYS are dropped,
+#    and so are the oldest files once the directory exceeds CACHE_MAX_BYTES.
+#    Deleting the directory at any time is safe.
+CACHE_DIR = ".cache"
+# Part of every cache file name: bump when the parsing or the cell encoding
+# below changes, so files written by older code are never served
+CACHE_SCHEMA = 2
+CACHE_MAX_AGE_DAYS = 7
+CACHE_MAX_BYTES = 256 * 1024 ** 2
+INPUT_SHEETS = ("settings", "lgs", "fps", "vehicles", "lg_capacity")
+
+#    Object columns mixing numbers and text (Mapped_LG_IDs 1 next to "1,2,3",
+#    Settings.Value next to a text parameter) are cached as text plus a
+#    per-cell type column, and decoded back to the original cells, so a cache
+#    hit returns exactly what a cold load parsed.
+CELL_TYPE_SUFFIX = "__cell_type"
+CELL_PARSERS = {"bool": lambda v: v == "True", "int": int, "float": float, "str": str}
+
+def cell_type(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    raise ValueError(f"can't cache {type(value).__name__} cells")
+
+def encode_cells(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    # dtype == object only: pandas 3 string columns round-trip on their own
+    for c in [c for c in df.columns if df[c].dtype == object]:
+        present = df[c].notna()
+        out[c] = df[c].where(~present, df[c].astype(str))
+        out[c + CELL_TYPE_SUFFIX] = df[c].map(cell_type, na_action="ignore")
+    return out
+
+def decode_cells(df: pd.DataFrame) -> pd.DataFrame:
+    for tc in [c for c in df.columns if str(c).endswith(CELL_TYPE_SUFFIX)]:
+        c = tc[:-len(CELL_TYPE_SUFFIX)]
+        df[c] = pd.Series(
+            [np.nan if pd.isna(t) else CELL_PARSERS[t](v) for v, t in zip(df[c], df[tc])],
+            index=df.index, dtype=object,
+        )
+        df = df.drop(columns=tc)
+    return df
+
+def prune_cache() -> None:
+    """Drops expired cache files, then the oldest ones until CACHE_DIR fits CACHE_MAX_BYTES."""
+    files = sorted((info.st_mtime, info.st_size, e.path)
+                   for e in os.scandir(CACHE_DIR) for info in [e.stat()])
+    cutoff = time.time() - CACHE_MAX_AGE_DAYS * 86400
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # already removed by another session
+        total -= size
+
+def workbook_digest(src) -> str:
+    """SHA-1 of the workbook bytes; accepts a path or an uploaded buffer."""
+    if hasattr(src, "getvalue"):
+        data = src.getvalue()
+    else:
+        with open(src, "rb") as f:
+            data = f.read()
+    return hashlib.sha1(data).hexdigest()
+
+# Streamlit would otherwise hash an UploadedFile by its contents *and* read
+# position, so re-reads or re-uploads of the same workbook miss the cache.
+@st.cache_data(hash_funcs={"streamlit.runtime.uploaded_file_manager.UploadedFile": workbook_digest})
 def load_inputs(path):
-    settings = pd.read_excel(path, sheet_name="Settings")
-    lgs      = pd.read_excel(path, sheet_name="LGs")
-    fps      = pd.read_excel(path, sheet_name="FPS")
+    digest = workbook_digest(path)
+    cached = [
+        os.path.join(CACHE_DIR, f"{digest}_{EXCEL_ENGINE}_v{CACHE_SCHEMA}_{name}.parquet")
+        for name in INPUT_SHEETS
+    ]
+    if all(os.path.exists(p) for p in cached):
+        try:
+            return tuple(decode_cells(pd.read_parquet(p)) for p in cached)
+        except (OSError, ValueError, KeyError):
+            pass  # unreadable or vanished cache file: parse the workbook again
+
+    if hasattr(path, "seek"):
+        path.seek(0)
+    # Open the workbook once so every sheet shares the parsed container
+    with pd.ExcelFile(path, engine=EXCEL_ENGINE) as xl:
+        settings = xl.parse("Settings")
+        lgs      = xl.parse("LGs")
+        fps      = xl.parse("FPS")
+        # Optional sheets: check sheet_names instead of catching parse() errors
+        if "Vehicles" in xl.sheet_names:
+            vehicles = xl.parse("Vehicles")
+        else:
+            vehicles = pd.DataFrame(columns=["Vehicle_ID", "Capacity_tons", "Mapped_LG_IDs"])
+        if "LG_Capacity" in xl.sheet_names:
+            lg_capacity = xl.parse("LG_Capacity")
+        else:
+            # run_simulation falls back to LGs.Storage_Capacity_tons
+            lg_capacity = pd.DataFrame()
+
+    # Best effort, all or nothing: every sheet goes to a temp name first and
+    # is only moved into place (atomically) once all five were written, so
+    # other sessions never see a partial cache.
+    tmp_paths = [f"{p}.{uuid.uuid4().hex}.tmp" for p in cached]
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for df, tmp in zip((settings, lgs, fps, vehicles, lg_capacity), tmp_paths):
+            encode_cells(df).to_parquet(tmp, compression="zstd")
+        for tmp, p in zip(tmp_paths, cached):
+            os.replace(tmp, p)
+    except (OSError, TypeError, ValueError):
+        for tmp in tmp_paths:
+            if os.path.exists(tmp):
+                os.remove(tmp)
     try:
-        vehicles = pd.read_excel(path, sheet_name="Vehicles")
-    except ValueError:
-        vehicles = pd.DataFrame(columns=["Vehicle_ID", "Capacity_tons", "Mapped_LG_IDs"])
-    return settings, lgs, fps, vehicles
+        prune_cache()
+    except OSError:
+        pass
+    return settings, lgs, fps, vehicles, lg_capacity
 
-settings, lgs, fps, vehicles = load_inputs(master)
+settings, lgs, fps, vehicles, lg_capacity = load_inputs(master)
 
 # 5. Preview inputs
 with st.expander("🔍 Preview Inputs"):
@@ -50,31 +200,47 @@ with st.expander("🔍 Preview Inputs"):
     st.subheader("Vehicles");      st.dataframe(vehicles)
 
 # 6. Run simulation
+#    Packaged results live in session_state, tagged with the workbook digest,
+#    so reruns (e.g. clicking a download button) reuse them instead of
+#    dropping or recomputing them. Only the latest workbook's results are kept.
+wb_digest = workbook_digest(master)
 if st.button("▶️ Run Simulation"):
     with st.spinner("Running…"):
         dispatch_cg, dispatch_lg, stock_levels = run_simulation(
-            master, settings, lgs, fps, vehicles
+            master, settings, lgs, fps, vehicles, lg_capacity
+        )
+
+        # 7. Package outputs into an Excel workbook (plus a Parquet bundle)
+        output_sheets = {
+            "Settings":      settings,
+            "LGs":           lgs,
+            "FPS":           fps,
+            "Vehicles":      vehicles,
+            "CG_to_LG":      dispatch_cg,
+            "LG_to_FPS":     dispatch_lg,
+            "Stock_Levels":  stock_levels
+        }
+        st.session_state["sim_result"] = (
+            wb_digest, to_excel(output_sheets), to_parquet_bundle(output_sheets)
         )
     st.success("✅ Simulation complete")
 
-    # 7. Package outputs into an Excel workbook
-    output_sheets = {
-        "Settings":      settings,
-        "LGs":           lgs,
-        "FPS":           fps,
-        "Vehicles":      vehicles,
-        "CG_to_LG":      dispatch_cg,
-        "LG_to_FPS":     dispatch_lg,
-        "Stock_Levels":  stock_levels
-    }
-    excel_data = to_excel(output_sheets)
-
-    # 8. Download button
+sim_result = st.session_state.get("sim_result")
+if sim_result is not None and sim_result[0] == wb_digest:
+    _, excel_data, parquet_data = sim_result
+
+    # 8. Download buttons
     st.download_button(
         label="📥 Download simulation_output.xlsx",
         data=excel_data,
         file_name="simulation_output.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
+    st.download_button(
+        label="📦 Download simulation_output_parquet.zip",
+        data=parquet_data,
+        file_name="simulation_output_parquet.zip",
+        mime="application/zip"
+    )
 else:
     st.info("Upload your master workbook above and then click ▶️ to run the simulation.")
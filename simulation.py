@@ -1,14 +1,146 @@
 # simulation.py
 
+import numpy as np
 import pandas as pd
 import math
 
+# Prefer the Rust-based calamine reader when python-calamine is installed;
+# fall back to openpyxl so deployments without the optional dep still work.
+# pandas already opens openpyxl workbooks with read_only=True/data_only=True
+# (streaming rows instead of loading the full DOM), so no engine_kwargs are
+# needed on the fallback path.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+# Numba is optional as well: without it the kernels below run as plain Python.
+# With Numba they are compiled with nogil=True and only touch their own
+# arguments, so concurrent run_simulation calls can overlap inside them; the
+# plain-Python fallback runs them under the GIL.
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+
+def _downcast_ints(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    """Store integer key columns in the smallest integer dtype that holds them.
+
+    int16 is the floor: int8 would let arithmetic on exported columns
+    (e.g. Day + offset) wrap past 127.
+    """
+    for col in cols:
+        small = pd.to_numeric(df[col], downcast="integer")
+        df[col] = small.astype(np.result_type(small.dtype, np.int16))
+    return df
+
+
+def _per_lg(lg_ids: pd.Series, values: pd.Series, lg_order) -> np.ndarray:
+    """Values keyed by LG_ID as a float array in `lg_order` (later rows win, 0.0 if absent)."""
+    s = pd.Series(values.astype(float).to_numpy(), index=lg_ids.astype(np.int64).to_numpy())
+    s = s[~s.index.duplicated(keep="last")]
+    # Fresh writable copy: the dispatch kernels update stocks in place
+    return np.array(s.reindex(lg_order, fill_value=0.0), dtype=np.float64)
+
+
+@njit(cache=True, nogil=True)
+def _cg_dispatch_kernel(R, capacity, stock, n_vehicles, truck_cap):
+    """
+    CG → LG dispatch over a dense LG x Day requirement matrix `R`.
+
+    Each day, LGs are served in row order with up to `n_vehicles` trips,
+    each capped by `truck_cap`; the trip count per LG is computed up front
+    from the shortfall and the LG's free room. `stock` is updated
+    in place. Returns (day, vehicle_id, lg_pos, qty) arrays, one per trip.
+    """
+    n_lg, n_days = R.shape
+    max_rows = n_days * max(n_vehicles, 0)
+    out_day = np.empty(max_rows, dtype=np.int64)
+    out_vid = np.empty(max_rows, dtype=np.int64)
+    out_lg  = np.empty(max_rows, dtype=np.int64)
+    out_qty = np.empty(max_rows, dtype=np.float64)
+    n = 0
+
+    for d in range(n_days):
+        trips_left = n_vehicles
+
+        # Serve today's requirement first for each LG
+        for i in range(n_lg):
+            if trips_left <= 0 or truck_cap <= 1e-9:
+                break
+            # Ship what is needed, as far as the LG has room: full trucks
+            # plus one part load, limited by the trips left today
+            amount = min(max(0.0, R[i, d] - stock[i]), max(0.0, capacity[i] - stock[i]))
+            if amount <= 1e-9:
+                continue
+            n_trips = min(trips_left, int(math.ceil((amount - 1e-9) / truck_cap)))
+            for t in range(n_trips):
+                # assign a simple rotating vehicle id 1..n_vehicles
+                out_day[n] = d + 1
+                out_vid[n] = n_vehicles - trips_left + t + 1
+                out_lg[n]  = i
+                out_qty[n] = min(truck_cap, amount - t * truck_cap)
+                stock[i] += out_qty[n]
+                n += 1
+            trips_left -= n_trips
+
+        # Optional: If trips remain, you could pre-stock for future days (round-robin).
+        # Skipped here to keep logic minimal and strictly "no backlog on the day" as per your earlier constraints.
+
+    return out_day[:n], out_vid[:n], out_lg[:n], out_qty[:n]
+
+
+@njit(cache=True, nogil=True)
+def _lg_dispatch_kernel(selected, fps_lg_pos, need, veh_cap, trips_used, max_trips,
+                        lg_stock, fps_stock, veh_offsets, veh_index,
+                        out_vpos, out_fpos, out_qty, n):
+    """
+    One day of LG → FPS dispatch for the FPS indices in `selected` (already
+    in priority order).
+
+    Vehicles serving LG position p are veh_index[veh_offsets[p]:veh_offsets[p+1]]
+    in preference order; the first with trips left is used. Stocks and
+    `trips_used` are updated in place and each trip is written to the
+    output buffers starting at row `n`. Returns the new row count.
+    """
+    for i in selected:
+        lpos = fps_lg_pos[i]
+        vpos = -1
+        for k in range(veh_offsets[lpos], veh_offsets[lpos + 1]):
+            if trips_used[veh_index[k]] < max_trips:
+                vpos = veh_index[k]
+                break
+        if vpos < 0:
+            continue
+
+        qty = min(veh_cap[vpos], need[i], lg_stock[lpos])
+        if qty <= 0:
+            continue
+
+        out_vpos[n] = vpos
+        out_fpos[n] = i
+        out_qty[n]  = qty
+        n += 1
+
+        # update stocks & vehicle usage
+        lg_stock[lpos] -= qty
+        fps_stock[i] += qty
+        trips_used[vpos] += 1
+    return n
+
+
 def run_simulation(
-    master_workbook,          # str path or file-like buffer
+    master_workbook,          # str path, file-like buffer, or an open pd.ExcelFile
     settings: pd.DataFrame,
     lgs: pd.DataFrame,
     fps: pd.DataFrame,
-    vehicles: pd.DataFrame
+    vehicles: pd.DataFrame,
+    lg_capacity: pd.DataFrame | None = None
 ) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
     """
     Runs a two-phase simulation:
@@ -20,6 +152,10 @@ def run_simulation(
     2) CG → LG pre-dispatch using derived LG daily requirement from phase (1)
        - Produces `dispatch_cg` with columns: Day, Vehicle_ID, LG_ID, Quantity_tons
 
+    LG capacities come from `lg_capacity` (the pre-loaded LG_Capacity sheet)
+    when given; otherwise that sheet is read from `master_workbook`. Either
+    way, LGs.Storage_Capacity_tons is the fallback.
+
     Returns:
         (dispatch_cg, dispatch_lg, stock_levels)
     """
@@ -27,10 +163,15 @@ def run_simulation(
     # -----------------------------
     # 0) Read key parameters safely
     # -----------------------------
+    # Materialize the small Settings sheet once; the first row for a parameter wins
+    params = {}
+    if {"Parameter", "Value"} <= set(settings.columns):
+        for name, value in zip(settings["Parameter"], settings["Value"]):
+            params.setdefault(name, value)
+
     def _get_setting(param_name, default=None, cast=float):
         try:
-            val = settings.loc[settings["Parameter"] == param_name, "Value"].iloc[0]
-            return cast(val)
+            return cast(params[param_name])
         except Exception:
             if default is None:
                 raise ValueError(f"Missing required setting: {param_name}")
@@ -54,19 +195,15 @@ def run_simulation(
     lgid_by_name = {str(nm).strip().lower(): int(lg_id) for lg_id, nm in zip(lgs["LG_ID"], lgs["LG_Name"])}
     valid_lg_ids = set(int(x) for x in lgs["LG_ID"])
 
-    def normalize_lg_ref(val):
-        """Accepts either an int-like ID or a name; returns int LG_ID or None."""
-        if pd.isna(val):
-            return None
-        s = str(val).strip()
-        # Try as int ID
-        try:
-            i = int(float(s))  # handles "5" or "5.0"
-            return i if i in valid_lg_ids else None
-        except ValueError:
-            pass
-        # Try as name
-        return lgid_by_name.get(s.lower())
+    def resolve_lg_refs(refs: pd.Series) -> pd.Series:
+        """Maps stripped LG references to LG_ID (NaN where unresolved).
+
+        Numeric references ("5", "5.0") must be valid LG_IDs; anything else is
+        looked up as an LG name.
+        """
+        as_num = pd.to_numeric(refs, errors="coerce")
+        by_id = np.trunc(as_num).where(lambda ids: ids.isin(valid_lg_ids))
+        return by_id.where(as_num.notna(), refs.str.lower().map(lgid_by_name))
 
     # Make sure FPS has core columns
     req_cols = {"FPS_ID", "Monthly_Demand_tons", "Max_Capacity_tons", "Linked_LG_ID"}
@@ -75,18 +212,19 @@ def run_simulation(
         raise ValueError(f"FPS sheet missing required columns: {missing}")
 
     fps = fps.copy()
-    # Ensure Lead_Time_days exists and fill NaN with default
-    if "Lead_Time_days" not in fps.columns:
-        fps["Lead_Time_days"] = DEFAULT_LEAD
+    # Lead time per FPS (missing column or NaN -> default)
+    if "Lead_Time_days" in fps.columns:
+        lead_time = fps["Lead_Time_days"].fillna(DEFAULT_LEAD).to_numpy(dtype=float)
     else:
-        fps["Lead_Time_days"] = fps["Lead_Time_days"].fillna(DEFAULT_LEAD)
+        lead_time = np.full(len(fps), DEFAULT_LEAD)
 
-    # Compute daily demand and thresholds
-    fps["Daily_Demand_tons"] = fps["Monthly_Demand_tons"] / 30.0
-    fps["Reorder_Threshold_tons"] = fps["Daily_Demand_tons"] * fps["Lead_Time_days"]
+    # Compute daily demand and thresholds (one array slot per FPS row)
+    daily_demand = fps["Monthly_Demand_tons"].to_numpy(dtype=float) / 30.0
+    thr = daily_demand * lead_time
 
     # Attach LG_ID (normalized) to each FPS
-    fps["LG_ID"] = fps["Linked_LG_ID"].apply(normalize_lg_ref)
+    refs = pd.Series(fps["Linked_LG_ID"].to_numpy())
+    fps["LG_ID"] = resolve_lg_refs(refs.dropna().astype(str).str.strip()).reindex(refs.index).to_numpy()
     if fps["LG_ID"].isna().any():
         bad_rows = fps[fps["LG_ID"].isna()][["FPS_ID", "Linked_LG_ID"]]
         raise ValueError(
@@ -117,36 +255,33 @@ def run_simulation(
             # If not given, assume each vehicle can serve all LGs
             vehicles["Mapped_LG_IDs"] = ",".join(str(x) for x in sorted(valid_lg_ids))
 
-    # Parse Mapped_LG_IDs into normalized lists for easy filtering
-    def parse_lg_list(val):
-        if pd.isna(val):
-            return []
-        out = []
-        for token in str(val).split(","):
-            token = token.strip()
-            if not token:
-                continue
-            # try ID then name
-            try:
-                i = int(float(token))
-                if i in valid_lg_ids:
-                    out.append(i)
-                    continue
-            except ValueError:
-                pass
-            # maybe it is a name
-            mapped = normalize_lg_ref(token)
-            if mapped is not None:
-                out.append(mapped)
-        return sorted(set(out))
-
-    vehicles["Mapped_LGs_List"] = vehicles["Mapped_LG_IDs"].apply(parse_lg_list)
-    if vehicles["Mapped_LGs_List"].apply(len).eq(0).any():
-        bad = vehicles[vehicles["Mapped_LGs_List"].apply(len).eq(0)][["Vehicle_ID", "Mapped_LG_IDs"]]
+    # Parse Mapped_LG_IDs ("1,3", "North Godown, 2", ...) for all vehicles in
+    # one pass: numeric tokens must be valid LG_IDs, any other token is looked
+    # up as an LG name. Yields one (vehicle row, LG_ID) pair per mapping,
+    # indexed per LG below so dispatch never scans every vehicle.
+    tokens = (
+        pd.Series(vehicles["Mapped_LG_IDs"].to_numpy()).dropna()
+        .astype(str).str.split(",").explode().str.strip()
+    )
+    tokens = tokens[tokens != ""]
+    lg_ref = resolve_lg_refs(tokens).dropna()
+    pairs = pd.DataFrame({
+        "veh": lg_ref.index.to_numpy(dtype=np.intp),
+        "lg": lg_ref.to_numpy(dtype=np.int64)
+    }).drop_duplicates()
+    pair_veh = pairs["veh"].to_numpy()
+    pair_lg = pairs["lg"].to_numpy()
+
+    n_mapped = np.bincount(pair_veh, minlength=len(vehicles))
+    if (n_mapped == 0).any():
+        bad = vehicles.loc[n_mapped == 0, ["Vehicle_ID", "Mapped_LG_IDs"]]
         raise ValueError(
             "Some vehicles couldn't map any LGs from 'Mapped_LG_IDs'. "
             f"Examples:\n{bad.head(5).to_string(index=False)}"
         )
+    is_shared = n_mapped > 1
+    veh_cap = vehicles["Capacity_tons"].to_numpy(dtype=float)
+    trips_used = np.zeros(len(vehicles), dtype=np.int32)
 
     # -----------------------------
     # 3) LG → FPS SIMULATION
@@ -155,161 +290,148 @@ def run_simulation(
     if "Initial_Allocation_tons" not in lgs.columns:
         lgs["Initial_Allocation_tons"] = 0.0
 
-    lg_stock = {int(row["LG_ID"]): float(row["Initial_Allocation_tons"]) for _, row in lgs.iterrows()}
-    fps_stock = {int(fid): 0.0 for fid in fps["FPS_ID"]}
-
-    dispatch_lg_rows = []
-    stock_rows = []
+    # LG stock as a dense array in LGs row order (first occurrence of each ID);
+    # lg_index maps LG_ID -> array position
+    stock_lg_ids = pd.unique(lgs["LG_ID"].astype(np.int64).to_numpy())
+    lg_stock_arr = _per_lg(lgs["LG_ID"], lgs["Initial_Allocation_tons"], stock_lg_ids)
+    lg_index = pd.Index(stock_lg_ids)
+
+    # Vehicles per LG position in CSR form for the dispatch kernel, sorted once
+    # by LG, then shared vehicles (mapped to >1 LG) first, then row order, so
+    # dispatch simply takes the first candidate with trips left
+    pair_lg_pos = lg_index.get_indexer(pair_lg)
+    veh_index = pair_veh[np.lexsort((pair_veh, ~is_shared[pair_veh], pair_lg_pos))]
+    veh_offsets = np.zeros(len(stock_lg_ids) + 1, dtype=np.intp)
+    veh_offsets[1:] = np.cumsum(np.bincount(pair_lg_pos, minlength=len(stock_lg_ids)))
+
+    # Remaining FPS columns as plain arrays (struct-of-arrays, indexed by FPS
+    # row position) so the daily loop never touches pandas rows
+    fps_ids = fps["FPS_ID"].astype(int).to_numpy()
+    fps_lg  = fps["LG_ID"].to_numpy()
+    fps_lg_pos = lg_index.get_indexer(fps_lg)
+    maxcap  = fps["Max_Capacity_tons"].to_numpy(dtype=float)
+    fps_stock_arr = np.zeros(len(fps))
+
+    # Preallocated record buffers, filled by running index. Each FPS gets at
+    # most one dispatch per day; each day records every LG and FPS stock.
+    max_lg_rows = DAYS * len(fps)
+    lgp_day  = np.empty(max_lg_rows, dtype=np.int64)
+    lgp_vpos = np.empty(max_lg_rows, dtype=np.intp)
+    lgp_fpos = np.empty(max_lg_rows, dtype=np.intp)
+    lgp_qty  = np.empty(max_lg_rows, dtype=np.float64)
+    n_lgp = 0
+
+    # End-of-day stock history, one row per day laid out as the output rows
+    # (every LG, then every FPS), so it ravels into Stock_Level_tons as is
+    n_lg = len(stock_lg_ids)
+    stock_hist = np.empty((DAYS, n_lg + len(fps)), dtype=np.float64)
 
     for day in range(1, DAYS + 1):
-        # 3a) FPS consumes daily demand
-        for _, r in fps.iterrows():
-            fid = int(r["FPS_ID"])
-            fps_stock[fid] = max(0.0, fps_stock[fid] - float(r["Daily_Demand_tons"]))
-
-        # 3b) Compute needs
-        needs = []
-        for _, r in fps.iterrows():
-            fid  = int(r["FPS_ID"])
-            lgid = int(r["LG_ID"])
-            current = fps_stock[fid]
-            threshold = float(r["Reorder_Threshold_tons"])
-            max_cap  = float(r["Max_Capacity_tons"])
-            if current <= threshold:
-                available_at_lg = lg_stock.get(lgid, 0.0)
-                need_qty = min(max_cap - current, available_at_lg)
-                if need_qty > 0:
-                    urgency = (threshold - current) / float(r["Daily_Demand_tons"]) if r["Daily_Demand_tons"] > 0 else 0
-                    needs.append((urgency, fid, lgid, need_qty))
-        needs.sort(reverse=True, key=lambda x: x[0])
-
-        # 3c) Reset vehicle usage counters for the day
-        vehicles["Trips_Used"] = 0
-
-        # 3d) Dispatch loop
-        for urgency, fid, lgid, need_qty in needs:
-            # candidate vehicles that can serve this LG and have trips left
-            cand = vehicles[vehicles["Mapped_LGs_List"].apply(lambda lst: lgid in lst)].copy()
-            cand = cand[cand["Trips_Used"] < MAX_TRIPS]
-            if cand.empty:
-                continue
-
-            # Prefer shared vehicles (mapped to >1 LG)
-            cand["is_shared"] = cand["Mapped_LGs_List"].apply(lambda lst: len(lst) > 1)
-            cand = cand.sort_values(["is_shared"], ascending=False)
-            chosen = cand.iloc[0]
-
-            vid = chosen["Vehicle_ID"]
-            cap = float(chosen["Capacity_tons"])
-            qty = min(cap, need_qty, lg_stock.get(lgid, 0.0))
-            if qty <= 0:
-                continue
-
-            dispatch_lg_rows.append({
-                "Day": int(day),
-                "Vehicle_ID": vid,
-                "LG_ID": int(lgid),           # <-- GUARANTEED LG_ID
-                "FPS_ID": int(fid),
-                "Quantity_tons": float(qty)
-            })
-
-            # update stocks & vehicle usage
-            lg_stock[lgid] = lg_stock.get(lgid, 0.0) - qty
-            fps_stock[fid] = fps_stock.get(fid, 0.0) + qty
-            vehicles.loc[vehicles["Vehicle_ID"] == vid, "Trips_Used"] += 1
+        # 3a) FPS consumes daily demand (in place, no temporaries). fmax, not
+        #     maximum: a blank demand makes the stock NaN, which clamps to 0.0
+        #     like the scalar max(0.0, ...) did
+        np.subtract(fps_stock_arr, daily_demand, out=fps_stock_arr)
+        np.fmax(fps_stock_arr, 0.0, out=fps_stock_arr)
+
+        # 3b) Compute needs (FPS at or below their reorder threshold whose LG
+        #     can supply something), most urgent first; the stable sort keeps
+        #     FPS order on ties
+        #     min(headroom, available) with scalar min() semantics, which
+        #     (unlike np.minimum) ignores a NaN LG stock
+        headroom = maxcap - fps_stock_arr
+        available = lg_stock_arr[fps_lg_pos]
+        need = np.where(available < headroom, available, headroom)
+        triggered = np.flatnonzero((fps_stock_arr <= thr) & (need > 0))
+        dd = daily_demand[triggered]
+        urgency = np.divide(thr[triggered] - fps_stock_arr[triggered], dd,
+                            out=np.zeros(len(triggered)), where=dd > 0)
+        selected = triggered[np.argsort(-urgency, kind="stable")]
+
+        # 3c) Reset vehicle usage counters for the day (by vehicle row position)
+        trips_used.fill(0)
+
+        # 3d) Dispatch loop (compiled); appends this day's trips at n_lgp
+        n_new = _lg_dispatch_kernel(selected, fps_lg_pos, need, veh_cap, trips_used, MAX_TRIPS,
+                                    lg_stock_arr, fps_stock_arr, veh_offsets, veh_index,
+                                    lgp_vpos, lgp_fpos, lgp_qty, n_lgp)
+        lgp_day[n_lgp:n_new] = day
+        n_lgp = n_new
 
         # 3e) Record end-of-day stocks
-        for lgid, st in lg_stock.items():
-            stock_rows.append({"Day": int(day), "Entity_Type": "LG",  "Entity_ID": int(lgid), "Stock_Level_tons": float(st)})
-        for fid, st in fps_stock.items():
-            stock_rows.append({"Day": int(day), "Entity_Type": "FPS", "Entity_ID": int(fid),  "Stock_Level_tons": float(st)})
-
-    # Build DataFrames with **expected schema**
-    dispatch_lg = pd.DataFrame(dispatch_lg_rows, columns=["Day","Vehicle_ID","LG_ID","FPS_ID","Quantity_tons"])
-    stock_levels = pd.DataFrame(stock_rows, columns=["Day","Entity_Type","Entity_ID","Stock_Level_tons"])
-
-    # Ensure required columns exist even if empty (prevents KeyError later)
-    if dispatch_lg.empty:
-        dispatch_lg = pd.DataFrame(columns=["Day","Vehicle_ID","LG_ID","FPS_ID","Quantity_tons"])
+        stock_hist[day - 1, :n_lg] = lg_stock_arr
+        stock_hist[day - 1, n_lg:] = fps_stock_arr
+
+    # Build DataFrames with **expected schema** (columns exist even if empty)
+    dispatch_lg = pd.DataFrame({
+        "Day": lgp_day[:n_lgp],
+        "Vehicle_ID": vehicles["Vehicle_ID"].to_numpy()[lgp_vpos[:n_lgp]],
+        "LG_ID": fps_lg[lgp_fpos[:n_lgp]],          # <-- GUARANTEED LG_ID
+        "FPS_ID": fps_ids[lgp_fpos[:n_lgp]],
+        "Quantity_tons": lgp_qty[:n_lgp]
+    })
+    # Rows are day-major: each day lists every LG, then every FPS
+    stock_levels = pd.DataFrame({
+        "Day": np.repeat(np.arange(1, DAYS + 1), stock_hist.shape[1]),
+        "Entity_Type": np.tile(np.array(["LG"] * n_lg + ["FPS"] * len(fps), dtype=object), DAYS),
+        "Entity_ID": np.tile(np.concatenate([stock_lg_ids, fps_ids]), DAYS),
+        "Stock_Level_tons": stock_hist.ravel()
+    })
 
     # -----------------------------------------------
     # 4) Derive LG daily requirement from dispatch_lg
     # -----------------------------------------------
-    required_cols = {"LG_ID", "Day", "Quantity_tons"}
-    missing = required_cols - set(dispatch_lg.columns)
-    if missing:
-        raise ValueError(f"dispatch_lg is missing required columns: {missing}")
-
-    if dispatch_lg.empty:
-        # If nothing was dispatched, there is no derived requirement.
-        # To avoid crashing, create an all-zero requirement for the known LGs.
-        lg_daily_req = (
-            pd.MultiIndex.from_product([sorted(valid_lg_ids), range(1, DAYS + 1)], names=["LG_ID","Day"])
-            .to_frame(index=False)
-            .assign(Daily_Requirement_tons=0.0)
-        )
-    else:
-        lg_daily_req = (
-            dispatch_lg
-            .groupby(["LG_ID", "Day"])["Quantity_tons"]
-            .sum()
-            .reset_index()
-            .rename(columns={"Quantity_tons": "Daily_Requirement_tons"})
-        )
-
-    req_pivot = lg_daily_req.pivot_table(index="LG_ID", columns="Day",
-                                         values="Daily_Requirement_tons",
-                                         aggfunc="sum", fill_value=0.0)
+    # Sum the LG -> FPS trips straight from the record buffers into a dense
+    # LG x Day matrix (rows in LG_ID order) for positional access in the CG
+    # loop. LGs or days without dispatch simply stay at zero.
+    lg_order = np.sort(stock_lg_ids)
+    lg_row = np.empty(len(stock_lg_ids), dtype=np.intp)
+    lg_row[np.argsort(stock_lg_ids)] = np.arange(len(stock_lg_ids))
+    R = np.zeros((len(lg_order), DAYS), dtype=np.float64)
+    np.add.at(R, (lg_row[fps_lg_pos[lgp_fpos[:n_lgp]]], lgp_day[:n_lgp] - 1), lgp_qty[:n_lgp])
 
     # -----------------------------------------------
     # 5) CG → LG PRE-DISPATCH (same DAYS timeline)
     # -----------------------------------------------
     # Capacity
+    capacity = None
     try:
-        cap_df = pd.read_excel(master_workbook, sheet_name="LG_Capacity")
+        cap_df = lg_capacity
+        if cap_df is None:
+            # Reuse the caller's open workbook handle instead of re-parsing the file
+            if isinstance(master_workbook, pd.ExcelFile):
+                xl = master_workbook
+            else:
+                if hasattr(master_workbook, "seek"):
+                    master_workbook.seek(0)
+                xl = pd.ExcelFile(master_workbook, engine=EXCEL_ENGINE)
+            # Check for the sheet rather than letting parse() raise for it
+            cap_df = xl.parse("LG_Capacity") if "LG_Capacity" in xl.sheet_names else pd.DataFrame()
         if {"LG_ID","Capacity_tons"} <= set(cap_df.columns):
-            capacity = {int(r["LG_ID"]): float(r["Capacity_tons"]) for _, r in cap_df.iterrows()}
-        else:
-            raise ValueError
+            capacity = _per_lg(cap_df["LG_ID"], cap_df["Capacity_tons"], lg_order)
     except Exception:
+        pass  # unreadable workbook or malformed LG_Capacity rows: use the fallback
+    if capacity is None:
         if "Storage_Capacity_tons" not in lgs.columns:
             raise ValueError("Provide LG_Capacity sheet or 'Storage_Capacity_tons' in LGs.")
-        capacity = {int(r["LG_ID"]): float(r["Storage_Capacity_tons"]) for _, r in lgs.iterrows()}
+        capacity = _per_lg(lgs["LG_ID"], lgs["Storage_Capacity_tons"], lg_order)
 
     # start CG stocks at current LG stock (or 0 if you prefer fresh inflow)
-    lg_stock_cg = {int(r["LG_ID"]): float(r.get("Initial_LG_Stock", 0.0)) for _, r in lgs.iterrows()}
-
-    dispatch_cg_rows = []
-
-    def free_room(lg_id: int) -> float:
-        return max(0.0, capacity.get(lg_id, 0.0) - lg_stock_cg.get(lg_id, 0.0))
-
-    for day in range(1, DAYS + 1):
-        trips_left = TOT_V
-
-        # Serve today's requirement first for each LG
-        for lgid in req_pivot.index:
-            need_today = max(0.0, float(req_pivot.at[lgid, day]) - lg_stock_cg.get(lgid, 0.0))
-            # ship in trips while we still need and have trips
-            while trips_left > 0 and need_today > 1e-9:
-                # assign a simple rotating vehicle id 1..TOT_V
-                vid = TOT_V - trips_left + 1
-                qty = min(TRUCK_CAP, need_today, free_room(lgid))
-                if qty <= 1e-9:
-                    break
-                dispatch_cg_rows.append({
-                    "Day": int(day),
-                    "Vehicle_ID": int(vid),
-                    "LG_ID": int(lgid),
-                    "Quantity_tons": float(qty)
-                })
-                lg_stock_cg[lgid] = lg_stock_cg.get(lgid, 0.0) + qty
-                trips_left -= 1
-                need_today -= qty
-
-        # Optional: If trips remain, you could pre-stock for future days (round-robin).
-        # Skipped here to keep logic minimal and strictly "no backlog on the day" as per your earlier constraints.
-
-    dispatch_cg = pd.DataFrame(dispatch_cg_rows, columns=["Day","Vehicle_ID","LG_ID","Quantity_tons"])
+    initial_cg = lgs["Initial_LG_Stock"] if "Initial_LG_Stock" in lgs.columns else pd.Series(0.0, index=lgs.index)
+    lg_stock_cg = _per_lg(lgs["LG_ID"], initial_cg, lg_order)
+
+    cg_day, cg_vid, cg_lg, cg_qty = _cg_dispatch_kernel(R, capacity, lg_stock_cg, TOT_V, TRUCK_CAP)
+
+    dispatch_cg = pd.DataFrame({
+        "Day": cg_day,
+        "Vehicle_ID": cg_vid,
+        "LG_ID": lg_order[cg_lg],
+        "Quantity_tons": cg_qty
+    })
+
+    # Day/ID columns are small integers; tonnage stays float64 so threshold
+    # comparisons and summed quantities don't pick up float32 rounding.
+    _downcast_ints(dispatch_cg, ["Day", "Vehicle_ID", "LG_ID"])
+    _downcast_ints(dispatch_lg, ["Day", "LG_ID", "FPS_ID"])
+    _downcast_ints(stock_levels, ["Day", "Entity_ID"])
 
     return dispatch_cg, dispatch_lg, stock_levels